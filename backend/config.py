@@ -1,16 +1,28 @@
 """Configuration for the LLM Council."""
 
 import os
+from functools import lru_cache
+from typing import Dict
 from dotenv import load_dotenv
 
-load_dotenv()
 
-# CLIProxyAPIPlus configuration
-# API key is optional - CLIProxyAPIPlus uses OAuth for authentication
-CLIPROXY_API_KEY = os.getenv("CLIPROXY_API_KEY", "")
+@lru_cache(maxsize=1)
+def load_env_settings() -> Dict[str, str]:
+    """Parse .env once and resolve the proxy settings from the environment."""
+    load_dotenv()
+    return {
+        # API key is optional - CLIProxyAPIPlus uses OAuth for authentication
+        "CLIPROXY_API_KEY": os.getenv("CLIPROXY_API_KEY", ""),
+        # CLIProxyAPIPlus endpoint (default local instance)
+        "CLIPROXY_API_URL": os.getenv("CLIPROXY_API_URL", "http://localhost:8080/v1/chat/completions"),
+    }
+
 
-# CLIProxyAPIPlus endpoint (default local instance)
-CLIPROXY_API_URL = os.getenv("CLIPROXY_API_URL", "http://localhost:8080/v1/chat/completions")
+_settings = load_env_settings()
+
+# CLIProxyAPIPlus configuration
+CLIPROXY_API_KEY = _settings["CLIPROXY_API_KEY"]
+CLIPROXY_API_URL = _settings["CLIPROXY_API_URL"]
 
 # Council members - model identifiers for CLIProxyAPIPlus
 # Minimum 2 members required for council deliberation
@@ -1,158 +1,49 @@
 """FastAPI backend for LLM Council."""
 
 from fastapi import FastAPI, HTTPException
+from starlette.background import BackgroundTask
+from fastapi.middleware import Middleware
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
 import uuid
 import json
 import asyncio
-import subprocess
+import time
 import httpx
-import platform
-import urllib.request
-import tarfile
-import zipfile
-import os
-from pathlib import Path
 
 from . import storage
+from .openrouter import get_client, close_client
+from .start_proxy import (
+    get_binary_path,
+    download_binary,
+    setup_config,
+    run_oauth_login,
+    check_provider_auth,
+    start_proxy as launch_proxy,
+)
 from .council import run_full_council, generate_conversation_title, stage1_collect_responses, stage2_collect_rankings, stage3_synthesize_final, calculate_aggregate_rankings
 from .config import CLIPROXY_API_URL
 
-app = FastAPI(title="LLM Council API")
-
 # Track proxy process
 _proxy_process = None
 
-# Proxy configuration
-PROXY_DIR = Path(__file__).parent.parent / "cliproxy"
-RELEASE_URL = "https://github.com/router-for-me/CLIProxyAPIPlus/releases/latest/download"
-
-
-def get_platform_binary():
-    """Get the appropriate binary name for the current platform."""
-    system = platform.system().lower()
-    machine = platform.machine().lower()
-
-    if machine in ("x86_64", "amd64"):
-        arch = "amd64"
-    elif machine in ("arm64", "aarch64"):
-        arch = "arm64"
-    else:
-        arch = machine
-
-    if system == "darwin":
-        return f"cliproxy-darwin-{arch}.tar.gz"
-    elif system == "linux":
-        return f"cliproxy-linux-{arch}.tar.gz"
-    elif system == "windows":
-        return f"cliproxy-windows-{arch}.zip"
-    return None
-
-
-def get_binary_path():
-    """Get path to the proxy binary."""
-    if platform.system() == "Windows":
-        return PROXY_DIR / "cliproxy.exe"
-    return PROXY_DIR / "cliproxy"
+# Proxy health endpoint, derived from the chat completions URL
+HEALTH_URL = CLIPROXY_API_URL.rsplit('/v1/', 1)[0] + "/health"
 
+# Server-Sent Events framing
+SSE_PREFIX = b"data: "
+SSE_SUFFIX = b"\n\n"
 
-def download_proxy_binary():
-    """Download pre-built binary for current platform."""
-    PROXY_DIR.mkdir(parents=True, exist_ok=True)
-
-    binary_name = get_platform_binary()
-    if not binary_name:
-        print(f"Error: Unsupported platform {platform.system()} {platform.machine()}")
-        return False
-
-    binary_path = get_binary_path()
-    if binary_path.exists():
-        return True
-
-    url = f"{RELEASE_URL}/{binary_name}"
-    archive_path = PROXY_DIR / binary_name
-
-    print(f"Downloading CLIProxyAPIPlus ({binary_name})...")
-    try:
-        urllib.request.urlretrieve(url, archive_path)
-        print("Download complete!")
-
-        print("Extracting...")
-        if binary_name.endswith(".tar.gz"):
-            with tarfile.open(archive_path, "r:gz") as tar:
-                tar.extractall(PROXY_DIR)
-        elif binary_name.endswith(".zip"):
-            with zipfile.ZipFile(archive_path, "r") as zip_ref:
-                zip_ref.extractall(PROXY_DIR)
-
-        if platform.system() != "Windows":
-            os.chmod(binary_path, 0o755)
-
-        archive_path.unlink()
-        print(f"Binary ready at {binary_path}")
-        return True
-
-    except Exception as e:
-        print(f"Error downloading binary: {e}")
-        return False
-
-
-def setup_proxy_config():
-    """Create default config if not present."""
-    config_path = PROXY_DIR / "config.yaml"
-    if config_path.exists():
-        return True
-
-    config = """# CLIProxyAPIPlus Configuration for LLM Council
-server:
-  port: 8080
-
-providers:
-  openai:
-    enabled: true
-  gemini:
-    enabled: true
-  claude:
-    enabled: true
-"""
-    PROXY_DIR.mkdir(parents=True, exist_ok=True)
-    config_path.write_text(config)
-    return True
-
-
-def run_oauth_login(provider: str):
-    """Run OAuth login for a specific provider."""
-    binary = get_binary_path()
-    if not binary.exists():
-        return False
-
-    print(f"\nStarting OAuth login for {provider}...")
-    print("A browser window will open for authentication.")
-    try:
-        subprocess.run(
-            [str(binary), "login", provider],
-            cwd=PROXY_DIR,
-            check=True
-        )
-        print(f"Successfully authenticated with {provider}!")
-        return True
-    except subprocess.CalledProcessError:
-        print(f"OAuth login for {provider} failed or was cancelled.")
-        return False
-
-
-def check_provider_auth(provider: str) -> bool:
-    """Check if a provider has OAuth tokens stored."""
-    auth_file = PROXY_DIR / "auths" / f"{provider}.json"
-    return auth_file.exists()
+# Providers offered by the setup wizard
+COUNCIL_PROVIDERS = ["openai", "gemini", "claude"]
 
 
 def count_authenticated_providers():
     """Count how many providers are authenticated."""
-    return sum(1 for p in ["openai", "gemini", "claude"] if check_provider_auth(p))
+    return sum(1 for p in COUNCIL_PROVIDERS if check_provider_auth(p))
 
 
 def interactive_setup():
@@ -167,7 +58,7 @@ def interactive_setup():
     binary = get_binary_path()
     if not binary.exists():
         print("\n[1/3] Setting up CLIProxyAPIPlus...")
-        if not download_proxy_binary():
+        if not download_binary():
             print("Failed to download proxy. Please try manually.")
             return False
     else:
@@ -175,7 +66,7 @@ def interactive_setup():
 
     # Step 2: Setup config
     print("\n[2/3] Checking configuration...")
-    setup_proxy_config()
+    setup_config()
     print("Configuration ready.")
 
     # Step 3: OAuth login for each provider
@@ -231,34 +122,77 @@ def interactive_setup():
     return True
 
 
+def _consume_task_result(task: asyncio.Task):
+    """Retrieve a finished task's exception so it is never logged as unhandled."""
+    if not task.cancelled():
+        task.exception()
+
+
+def cancel_pending_tasks(*tasks: Optional[asyncio.Task]):
+    """Cancel any of the given tasks that are still running."""
+    for task in tasks:
+        if task is not None and not task.done():
+            task.cancel()
+
+
+async def cancel_pending_tasks_after_response(*tasks: Optional[asyncio.Task]):
+    """Background hook for cancel_pending_tasks; async so it runs on the event loop."""
+    cancel_pending_tasks(*tasks)
+
+
+def sse_event(payload: Dict[str, Any]) -> bytes:
+    """Encode a payload as a single Server-Sent Events frame."""
+    return SSE_PREFIX + json.dumps(payload, separators=(",", ":")).encode() + SSE_SUFFIX
+
+
+# Fixed frames, encoded once instead of on every request
+SSE_STAGE1_START = sse_event({"type": "stage1_start"})
+SSE_STAGE2_START = sse_event({"type": "stage2_start"})
+SSE_STAGE3_START = sse_event({"type": "stage3_start"})
+SSE_COMPLETE = sse_event({"type": "complete"})
+
+
 async def check_proxy_running() -> bool:
     """Check if CLIProxyAPIPlus is responding."""
     try:
-        async with httpx.AsyncClient(timeout=2.0) as client:
-            base_url = CLIPROXY_API_URL.rsplit('/v1/', 1)[0]
-            response = await client.get(f"{base_url}/health")
-            return response.status_code == 200
-    except:
+        response = await get_client().get(HEALTH_URL, timeout=0.5)
+        return response.status_code == 200
+    except (httpx.HTTPError, OSError):
         return False
 
 
+async def wait_for_proxy_ready(deadline: float = 5.0) -> bool:
+    """
+    Wait until CLIProxyAPIPlus answers its health check.
+
+    Probes start after 50ms and back off to at most 500ms apart, so a fast
+    proxy is detected almost immediately while a slow one still gets the
+    full deadline.
+
+    Args:
+        deadline: Maximum time to wait in seconds
+
+    Returns:
+        True if the proxy became ready, False on timeout or if it exited
+    """
+    end = time.monotonic() + deadline
+    delay = 0.05
+    while time.monotonic() < end:
+        if await check_proxy_running():
+            return True
+        if _proxy_process is not None and _proxy_process.poll() is not None:
+            return False
+        await asyncio.sleep(delay)
+        delay = min(delay * 1.5, 0.5)
+    return False
+
+
 def start_proxy():
     """Start CLIProxyAPIPlus if binary exists."""
     global _proxy_process
 
-    binary = get_binary_path()
-    if not binary.exists():
-        return False
-
-    print("Starting CLIProxyAPIPlus...")
-    _proxy_process = subprocess.Popen(
-        [str(binary), "server"],
-        cwd=PROXY_DIR,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT
-    )
-    print(f"CLIProxyAPIPlus started (PID: {_proxy_process.pid})")
-    return True
+    _proxy_process = launch_proxy()
+    return _proxy_process is not None
 
 
 def ensure_proxy_setup():
@@ -288,13 +222,24 @@ def ensure_proxy_setup():
             print("Warning: Council may not function properly with only 1 provider.")
 
 
-@app.on_event("startup")
+async def prepare_proxy_binary() -> bool:
+    """Download the proxy binary and default config off the event loop if missing."""
+    if get_binary_path().exists():
+        return True
+    if not await asyncio.to_thread(download_binary):
+        return False
+    return await asyncio.to_thread(setup_config)
+
+
 async def startup_event():
     """Start proxy on app startup if not already running."""
-    if not await check_proxy_running():
-        start_proxy()
-        await asyncio.sleep(1)
-        if await check_proxy_running():
+    running, _ = await asyncio.gather(
+        check_proxy_running(),
+        prepare_proxy_binary()
+    )
+
+    if not running:
+        if start_proxy() and await wait_for_proxy_ready():
             print("CLIProxyAPIPlus is ready")
         else:
             print("Warning: CLIProxyAPIPlus may not have started correctly")
@@ -302,7 +247,6 @@ async def startup_event():
         print("CLIProxyAPIPlus already running")
 
 
-@app.on_event("shutdown")
 async def shutdown_event():
     """Stop proxy on app shutdown."""
     global _proxy_process
@@ -311,14 +255,32 @@ async def shutdown_event():
         _proxy_process.terminate()
         _proxy_process.wait()
         _proxy_process = None
+    await close_client()
 
-# Enable CORS for local development
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5173", "http://localhost:3000"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run proxy startup before serving requests and cleanup on shutdown."""
+    await startup_event()
+    try:
+        yield
+    finally:
+        await shutdown_event()
+
+
+app = FastAPI(
+    title="LLM Council API",
+    lifespan=lifespan,
+    middleware=[
+        # Enable CORS for local development
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["http://localhost:5173", "http://localhost:3000"],
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+        ),
+    ],
 )
 
 
@@ -384,12 +346,12 @@ async def send_message(conversation_id: str, request: SendMessageRequest):
     Returns the complete response with all stages.
     """
     # Check if conversation exists
-    conversation = storage.get_conversation(conversation_id)
-    if conversation is None:
+    message_count = storage.get_message_count(conversation_id)
+    if message_count is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
     # Check if this is the first message
-    is_first_message = len(conversation["messages"]) == 0
+    is_first_message = message_count == 0
 
     # Add user message
     storage.add_user_message(conversation_id, request.content)
@@ -428,59 +390,73 @@ async def send_message_stream(conversation_id: str, request: SendMessageRequest)
     Returns Server-Sent Events as each stage completes.
     """
     # Check if conversation exists
-    conversation = storage.get_conversation(conversation_id)
-    if conversation is None:
+    message_count = storage.get_message_count(conversation_id)
+    if message_count is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
     # Check if this is the first message
-    is_first_message = len(conversation["messages"]) == 0
+    is_first_message = message_count == 0
 
-    async def event_generator():
-        try:
-            # Add user message
-            storage.add_user_message(conversation_id, request.content)
+    # Add user message
+    await asyncio.to_thread(storage.add_user_message, conversation_id, request.content)
 
-            # Start title generation in parallel (don't await yet)
-            title_task = None
-            if is_first_message:
-                title_task = asyncio.create_task(generate_conversation_title(request.content))
+    # Start title generation and Stage 1 now, so both are already in flight
+    # by the time the client receives the first event
+    title_task = None
+    if is_first_message:
+        title_task = asyncio.create_task(generate_conversation_title(request.content))
+    stage1_task = asyncio.create_task(stage1_collect_responses(request.content))
+    for task in (stage1_task, title_task):
+        if task is not None:
+            task.add_done_callback(_consume_task_result)
 
+    async def event_generator():
+        try:
             # Stage 1: Collect responses
-            yield f"data: {json.dumps({'type': 'stage1_start'})}\n\n"
-            stage1_results = await stage1_collect_responses(request.content)
-            yield f"data: {json.dumps({'type': 'stage1_complete', 'data': stage1_results})}\n\n"
+            yield SSE_STAGE1_START
+            stage1_results = await stage1_task
+            yield sse_event({'type': 'stage1_complete', 'data': stage1_results})
 
             # Stage 2: Collect rankings
-            yield f"data: {json.dumps({'type': 'stage2_start'})}\n\n"
+            yield SSE_STAGE2_START
             stage2_results, label_to_model = await stage2_collect_rankings(request.content, stage1_results)
             aggregate_rankings = calculate_aggregate_rankings(stage2_results, label_to_model)
-            yield f"data: {json.dumps({'type': 'stage2_complete', 'data': stage2_results, 'metadata': {'label_to_model': label_to_model, 'aggregate_rankings': aggregate_rankings}})}\n\n"
+            yield sse_event({'type': 'stage2_complete', 'data': stage2_results, 'metadata': {'label_to_model': label_to_model, 'aggregate_rankings': aggregate_rankings}})
 
             # Stage 3: Synthesize final answer
-            yield f"data: {json.dumps({'type': 'stage3_start'})}\n\n"
+            yield SSE_STAGE3_START
             stage3_result = await stage3_synthesize_final(request.content, stage1_results, stage2_results)
-            yield f"data: {json.dumps({'type': 'stage3_complete', 'data': stage3_result})}\n\n"
-
-            # Wait for title generation if it was started
-            if title_task:
-                title = await title_task
-                storage.update_conversation_title(conversation_id, title)
-                yield f"data: {json.dumps({'type': 'title_complete', 'data': {'title': title}})}\n\n"
+            yield sse_event({'type': 'stage3_complete', 'data': stage3_result})
 
-            # Save complete assistant message
-            storage.add_assistant_message(
+            # Save complete assistant message in the background
+            save_task = asyncio.create_task(asyncio.to_thread(
+                storage.add_assistant_message,
                 conversation_id,
                 stage1_results,
                 stage2_results,
                 stage3_result
-            )
+            ))
+
+            # Wait for title generation if it was started
+            if title_task:
+                title = await title_task
+                # Both writes rewrite the same file, so the title waits for the save
+                await save_task
+                await asyncio.to_thread(storage.update_conversation_title, conversation_id, title)
+                yield sse_event({'type': 'title_complete', 'data': {'title': title}})
+
+            await save_task
 
             # Send completion event
-            yield f"data: {json.dumps({'type': 'complete'})}\n\n"
+            yield SSE_COMPLETE
 
         except Exception as e:
             # Send error event
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            yield sse_event({'type': 'error', 'message': str(e)})
+
+        finally:
+            # Don't leave model calls running if the client went away
+            cancel_pending_tasks(stage1_task, title_task)
 
     return StreamingResponse(
         event_generator(),
@@ -488,7 +464,9 @@ async def send_message_stream(conversation_id: str, request: SendMessageRequest)
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-        }
+        },
+        # Also covers a response that ends before the generator ever ran
+        background=BackgroundTask(cancel_pending_tasks_after_response, stage1_task, title_task)
     )
 
 
@@ -1,8 +1,37 @@
 """LLM API client for making requests via CLIProxyAPIPlus."""
 
+import asyncio
 import httpx
 from typing import List, Dict, Any, Optional
-from .config import CLIPROXY_API_KEY, CLIPROXY_API_URL
+from .config import CLIPROXY_API_KEY, CLIPROXY_API_URL, COUNCIL_MODELS
+
+# Shared client so council calls reuse pooled keep-alive connections
+# instead of opening a new connection per request
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get the shared HTTP client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100),
+        )
+    return _client
+
+
+async def close_client():
+    """Close the shared HTTP client and release its connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# Caps in-flight parallel queries across all requests at one per council
+# member, so concurrent conversations don't burst past provider rate limits
+COUNCIL_SEMAPHORE = asyncio.Semaphore(len(COUNCIL_MODELS))
 
 
 async def query_model(
@@ -35,21 +64,21 @@ async def query_model(
     }
 
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(
-                CLIPROXY_API_URL,
-                headers=headers,
-                json=payload
-            )
-            response.raise_for_status()
-
-            data = response.json()
-            message = data['choices'][0]['message']
-
-            return {
-                'content': message.get('content'),
-                'reasoning_details': message.get('reasoning_details')
-            }
+        response = await get_client().post(
+            CLIPROXY_API_URL,
+            headers=headers,
+            json=payload,
+            timeout=timeout
+        )
+        response.raise_for_status()
+
+        data = response.json()
+        message = data['choices'][0]['message']
+
+        return {
+            'content': message.get('content'),
+            'reasoning_details': message.get('reasoning_details')
+        }
 
     except Exception as e:
         print(f"Error querying model {model}: {e}")
@@ -70,13 +99,21 @@ async def query_models_parallel(
     Returns:
         Dict mapping model identifier to response dict (or None if failed)
     """
-    import asyncio
+    async def bounded_query(model: str) -> Optional[Dict[str, Any]]:
+        async with COUNCIL_SEMAPHORE:
+            return await query_model(model, messages)
 
     # Create tasks for all models
-    tasks = [query_model(model, messages) for model in models]
+    tasks = [bounded_query(model) for model in models]
 
-    # Wait for all to complete
-    responses = await asyncio.gather(*tasks)
+    # Wait for all to complete; one failure must not cancel the others
+    responses = await asyncio.gather(*tasks, return_exceptions=True)
 
     # Map models to their responses
-    return {model: response for model, response in zip(models, responses)}
+    results = {}
+    for model, response in zip(models, responses):
+        if isinstance(response, BaseException):
+            print(f"Error querying model {model}: {response}")
+            response = None
+        results[model] = response
+    return results
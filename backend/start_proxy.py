@@ -4,42 +4,170 @@ Script to start CLIProxyAPIPlus and handle OAuth setup.
 Run this before starting the LLM Council backend.
 """
 
+import hashlib
+import io
 import os
 import sys
 import subprocess
 import platform
-import urllib.request
 import zipfile
 import tarfile
+import httpx
 import shutil
+import tempfile
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+from typing import Callable
 
 # Configuration
 PROXY_DIR = Path(__file__).parent.parent / "cliproxy"
 PROXY_PORT = 8080
 RELEASE_URL = "https://github.com/router-for-me/CLIProxyAPIPlus/releases/latest/download"
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+
+def download_file(url: str, dest: Path):
+    """Stream a file to disk in large chunks, returning the response ETag."""
+    # No overall limit for large files, but a stalled connection still fails
+    timeout = httpx.Timeout(None, connect=10.0, read=60.0)
+    with httpx.stream("GET", url, follow_redirects=True, timeout=timeout) as response:
+        response.raise_for_status()
+        with open(dest, "wb", buffering=DOWNLOAD_CHUNK_SIZE) as f:
+            # Reserve the full size up front to avoid fragmenting the file
+            length = response.headers.get("Content-Length")
+            if length and hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(f.fileno(), 0, int(length))
+            for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+            f.truncate()
+        return response.headers.get("ETag")
+
+
+def _safe_tar_members(tar: tarfile.TarFile, dest: Path):
+    """Yield tar members, refusing any that would land outside dest."""
+    dest_root = dest.resolve()
+    for member in tar:
+        target = (dest / member.name).resolve()
+        if target != dest_root and dest_root not in target.parents:
+            raise ValueError(f"Unsafe path in archive: {member.name}")
+        yield member
+
+
+def _extract_targz(archive_path: Path, dest: Path):
+    """Extract a .tar.gz archive using large buffered reads."""
+    # Stream mode reads the archive sequentially without seeking
+    with open(archive_path, "rb", buffering=DOWNLOAD_CHUNK_SIZE) as f:
+        with tarfile.open(fileobj=f, mode="r|gz") as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(dest, filter="data")
+            else:
+                tar.extractall(dest, members=_safe_tar_members(tar, dest))
+
+
+def _extract_zip(archive_path: Path, dest: Path):
+    """Extract a .zip archive using large buffered reads."""
+    dest_root = dest.resolve()
+    with zipfile.ZipFile(archive_path, "r") as zip_ref:
+        for info in zip_ref.infolist():
+            target = (dest / info.filename).resolve()
+            if target != dest_root and dest_root not in target.parents:
+                raise ValueError(f"Unsafe path in archive: {info.filename}")
+            if info.is_dir():
+                target.mkdir(parents=True, exist_ok=True)
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with zip_ref.open(info) as src, open(target, "wb") as out:
+                reader = io.BufferedReader(src, DOWNLOAD_CHUNK_SIZE)
+                shutil.copyfileobj(reader, out, DOWNLOAD_CHUNK_SIZE)
+
+
+@dataclass(frozen=True)
+class _PlatformOps:
+    """How the proxy release is packaged and installed on one OS."""
+    release_os: str
+    archive_ext: str
+    exe_suffix: str
+    chmod: bool
+    extract: Callable[[Path, Path], None]
+
+
+_PLATFORM_OPS = {
+    "Darwin": _PlatformOps("darwin", ".tar.gz", "", True, _extract_targz),
+    "Linux": _PlatformOps("linux", ".tar.gz", "", True, _extract_targz),
+    "Windows": _PlatformOps("windows", ".zip", ".exe", False, _extract_zip),
+}
+
+
+def _normalize_arch(machine: str) -> str:
+    """Map a machine name onto the architecture used in release names."""
+    if machine in ("x86_64", "amd64"):
+        return "amd64"
+    elif machine in ("arm64", "aarch64"):
+        return "arm64"
+    return machine
+
+
+# Platform details never change during a run, so resolve them once;
+# PLATFORM_OPS is None on an unsupported OS
+_SYSTEM = platform.system()
+_MACHINE = platform.machine().lower()
+PLATFORM_OPS = _PLATFORM_OPS.get(_SYSTEM)
+if PLATFORM_OPS is not None:
+    PLATFORM_BINARY = (
+        f"cliproxy-{PLATFORM_OPS.release_os}-{_normalize_arch(_MACHINE)}"
+        f"{PLATFORM_OPS.archive_ext}"
+    )
+    BINARY_PATH = PROXY_DIR / f"cliproxy{PLATFORM_OPS.exe_suffix}"
+else:
+    PLATFORM_BINARY = None
+    BINARY_PATH = PROXY_DIR / "cliproxy"
 
 
 def get_platform_binary():
     """Get the appropriate binary name for the current platform."""
-    system = platform.system().lower()
-    machine = platform.machine().lower()
+    return PLATFORM_BINARY
+
+
+def file_sha256(path: Path) -> str:
+    """Get the SHA-256 hex digest of a file, read in large chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def binary_is_current(binary_path: Path, url: str) -> bool:
+    """
+    Check an installed binary is intact and matches the latest release.
+
+    The binary is verified against the .sha256 sidecar if one was written
+    at install time, then the release's ETag is compared with the .etag
+    sidecar via a HEAD request. Missing sidecars or an unreachable release
+    server count as current, so a hand-installed binary or an offline
+    machine keeps its working binary.
+    """
+    sha_path = binary_path.with_suffix(".sha256")
+    if sha_path.exists() and sha_path.read_text().strip() != file_sha256(binary_path):
+        print(f"Checksum mismatch for {binary_path}, re-downloading...")
+        return False
 
-    if machine in ("x86_64", "amd64"):
-        arch = "amd64"
-    elif machine in ("arm64", "aarch64"):
-        arch = "arm64"
-    else:
-        arch = machine
-
-    if system == "darwin":
-        return f"cliproxy-darwin-{arch}.tar.gz"
-    elif system == "linux":
-        return f"cliproxy-linux-{arch}.tar.gz"
-    elif system == "windows":
-        return f"cliproxy-windows-{arch}.zip"
-    else:
-        return None
+    etag_path = binary_path.with_suffix(".etag")
+    if not etag_path.exists():
+        return True
+
+    try:
+        response = httpx.head(url, follow_redirects=True, timeout=10.0)
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return True
+
+    etag = response.headers.get("ETag")
+    if etag is None or etag == etag_path.read_text().strip():
+        return True
+    print("A newer CLIProxyAPIPlus release is available, updating...")
+    return False
 
 
 def download_binary():
@@ -48,44 +176,55 @@ def download_binary():
 
     binary_name = get_platform_binary()
     if not binary_name:
-        print(f"Error: Unsupported platform {platform.system()} {platform.machine()}")
+        print(f"Error: Unsupported platform {_SYSTEM} {_MACHINE}")
         return False
 
-    binary_path = PROXY_DIR / "cliproxy"
-    if platform.system() == "Windows":
-        binary_path = PROXY_DIR / "cliproxy.exe"
+    binary_path = get_binary_path()
+    url = f"{RELEASE_URL}/{binary_name}"
 
-    if binary_path.exists():
+    if binary_path.exists() and binary_is_current(binary_path, url):
         print(f"Binary already exists at {binary_path}")
         return True
 
-    url = f"{RELEASE_URL}/{binary_name}"
-    archive_path = PROXY_DIR / binary_name
+    sha_path = binary_path.with_suffix(".sha256")
+    etag_path = binary_path.with_suffix(".etag")
 
     print(f"Downloading {binary_name}...")
     try:
-        urllib.request.urlretrieve(url, archive_path)
-        print("Download complete!")
-
-        # Extract archive
-        print("Extracting...")
-        if binary_name.endswith(".tar.gz"):
-            with tarfile.open(archive_path, "r:gz") as tar:
-                tar.extractall(PROXY_DIR)
-        elif binary_name.endswith(".zip"):
-            with zipfile.ZipFile(archive_path, "r") as zip_ref:
-                zip_ref.extractall(PROXY_DIR)
-
-        # Make executable on Unix
-        if platform.system() != "Windows":
-            os.chmod(binary_path, 0o755)
-
-        # Clean up archive
-        archive_path.unlink()
+        # Download and extract into a scratch dir so an interrupted run can
+        # never leave a partial binary at binary_path
+        with tempfile.TemporaryDirectory(dir=PROXY_DIR) as tmp:
+            staging_dir = Path(tmp)
+            archive_path = staging_dir / binary_name
+            etag = download_file(url, archive_path)
+            print("Download complete!")
+
+            # Extract archive
+            print("Extracting...")
+            PLATFORM_OPS.extract(archive_path, staging_dir)
+            staged_binary = staging_dir / binary_path.name
+
+            # Make executable on Unix
+            if PLATFORM_OPS.chmod:
+                os.chmod(staged_binary, 0o755)
+
+            # Record what is being installed so later runs can skip or verify it
+            if etag:
+                etag_path.write_text(etag)
+            else:
+                etag_path.unlink(missing_ok=True)
+            sha_path.write_text(file_sha256(staged_binary))
+
+            os.replace(staged_binary, binary_path)
+
         print(f"Binary ready at {binary_path}")
         return True
 
     except Exception as e:
+        # Sidecars may no longer describe the binary on disk; drop them so
+        # the next run verifies from scratch
+        sha_path.unlink(missing_ok=True)
+        etag_path.unlink(missing_ok=True)
         print(f"Error downloading binary: {e}")
         print("\nManual install: Download from https://github.com/router-for-me/CLIProxyAPIPlus/releases")
         return False
@@ -123,9 +262,31 @@ providers:
 
 def get_binary_path():
     """Get path to the binary."""
-    if platform.system() == "Windows":
-        return PROXY_DIR / "cliproxy.exe"
-    return PROXY_DIR / "cliproxy"
+    return BINARY_PATH
+
+
+@lru_cache(maxsize=1)
+def _authed_providers() -> frozenset:
+    """Get the providers with stored OAuth tokens from a single directory scan."""
+    try:
+        with os.scandir(PROXY_DIR / "auths") as entries:
+            return frozenset(
+                entry.name.removesuffix(".json")
+                for entry in entries
+                if entry.name.endswith(".json")
+            )
+    except FileNotFoundError:
+        return frozenset()
+
+
+def refresh_provider_auth():
+    """Drop the cached auth snapshot so the next check rescans auths/."""
+    _authed_providers.cache_clear()
+
+
+def check_provider_auth(provider: str) -> bool:
+    """Check if a provider has OAuth tokens stored."""
+    return provider in _authed_providers()
 
 
 def run_oauth_login(provider: str):
@@ -139,10 +300,11 @@ def run_oauth_login(provider: str):
     print("A browser window will open for authentication.")
     try:
         subprocess.run(
-            [str(binary), "login", provider],
-            cwd=PROXY_DIR,
+            [str(binary.resolve()), "login", provider],
+            cwd=str(PROXY_DIR),
             check=True
         )
+        refresh_provider_auth()
         print(f"Successfully authenticated with {provider}!")
         return True
     except subprocess.CalledProcessError as e:
@@ -159,9 +321,14 @@ def start_proxy():
 
     print(f"\nStarting CLIProxyAPIPlus on port {PROXY_PORT}...")
     try:
+        # The proxy finds config.yaml and auths/ relative to its working
+        # directory, so cwd is required; that keeps subprocess on fork+exec
+        # rather than posix_spawn, which is fine for a single launch.
+        # The proxy never reads stdin.
         process = subprocess.Popen(
-            [str(binary), "server"],
-            cwd=PROXY_DIR,
+            [str(binary.resolve()), "server"],
+            cwd=str(PROXY_DIR),
+            stdin=subprocess.DEVNULL,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT
         )
@@ -2,11 +2,22 @@
 
 import json
 import os
+import tempfile
+import threading
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 from .config import DATA_DIR
 
+# Message counts keyed by conversation id, stored with the file mtime they
+# were read at so a changed file is never answered from a stale entry
+_message_counts: Dict[str, Tuple[int, int]] = {}
+
+# Per-conversation locks so read-modify-write updates from worker threads
+# can't interleave and drop each other's changes
+_conversation_locks: Dict[str, threading.RLock] = {}
+_conversation_locks_guard = threading.Lock()
+
 
 def ensure_data_dir():
     """Ensure the data directory exists."""
@@ -18,6 +29,35 @@ def get_conversation_path(conversation_id: str) -> str:
     return os.path.join(DATA_DIR, f"{conversation_id}.json")
 
 
+def _conversation_lock(conversation_id: str) -> threading.RLock:
+    """Get the lock that serializes writes to one conversation."""
+    with _conversation_locks_guard:
+        return _conversation_locks.setdefault(conversation_id, threading.RLock())
+
+
+def _write_conversation_file(path: str, conversation: Dict[str, Any]):
+    """
+    Write a conversation file atomically.
+
+    The JSON goes to a temp file in the data directory first and is then
+    renamed over the target, so readers never see a half-written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=DATA_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(conversation, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _remember_message_count(path: str, conversation: Dict[str, Any]):
+    """Record the message count of a conversation file just written or read."""
+    mtime = os.stat(path).st_mtime_ns
+    _message_counts[conversation["id"]] = (mtime, len(conversation["messages"]))
+
+
 def create_conversation(conversation_id: str) -> Dict[str, Any]:
     """
     Create a new conversation.
@@ -39,8 +79,9 @@ def create_conversation(conversation_id: str) -> Dict[str, Any]:
 
     # Save to file
     path = get_conversation_path(conversation_id)
-    with open(path, 'w') as f:
-        json.dump(conversation, f, indent=2)
+    with _conversation_lock(conversation_id):
+        _write_conversation_file(path, conversation)
+        _remember_message_count(path, conversation)
 
     return conversation
 
@@ -64,6 +105,37 @@ def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
         return json.load(f)
 
 
+def get_message_count(conversation_id: str) -> Optional[int]:
+    """
+    Get the number of messages in a conversation without reloading it.
+
+    The count is served from memory while the file is unchanged since it
+    was last written or read; otherwise the file is loaded once.
+
+    Args:
+        conversation_id: Unique identifier for the conversation
+
+    Returns:
+        Number of messages, or None if the conversation is not found
+    """
+    path = get_conversation_path(conversation_id)
+
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    cached = _message_counts.get(conversation_id)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    conversation = get_conversation(conversation_id)
+    if conversation is None:
+        return None
+    _remember_message_count(path, conversation)
+    return len(conversation["messages"])
+
+
 def save_conversation(conversation: Dict[str, Any]):
     """
     Save a conversation to storage.
@@ -74,8 +146,9 @@ def save_conversation(conversation: Dict[str, Any]):
     ensure_data_dir()
 
     path = get_conversation_path(conversation['id'])
-    with open(path, 'w') as f:
-        json.dump(conversation, f, indent=2)
+    with _conversation_lock(conversation['id']):
+        _write_conversation_file(path, conversation)
+        _remember_message_count(path, conversation)
 
 
 def list_conversations() -> List[Dict[str, Any]]:
@@ -115,16 +188,17 @@ def add_user_message(conversation_id: str, content: str):
         conversation_id: Conversation identifier
         content: User message content
     """
-    conversation = get_conversation(conversation_id)
-    if conversation is None:
-        raise ValueError(f"Conversation {conversation_id} not found")
+    with _conversation_lock(conversation_id):
+        conversation = get_conversation(conversation_id)
+        if conversation is None:
+            raise ValueError(f"Conversation {conversation_id} not found")
 
-    conversation["messages"].append({
-        "role": "user",
-        "content": content
-    })
+        conversation["messages"].append({
+            "role": "user",
+            "content": content
+        })
 
-    save_conversation(conversation)
+        save_conversation(conversation)
 
 
 def add_assistant_message(
@@ -142,18 +216,19 @@ def add_assistant_message(
         stage2: List of model rankings
         stage3: Final synthesized response
     """
-    conversation = get_conversation(conversation_id)
-    if conversation is None:
-        raise ValueError(f"Conversation {conversation_id} not found")
+    with _conversation_lock(conversation_id):
+        conversation = get_conversation(conversation_id)
+        if conversation is None:
+            raise ValueError(f"Conversation {conversation_id} not found")
 
-    conversation["messages"].append({
-        "role": "assistant",
-        "stage1": stage1,
-        "stage2": stage2,
-        "stage3": stage3
-    })
+        conversation["messages"].append({
+            "role": "assistant",
+            "stage1": stage1,
+            "stage2": stage2,
+            "stage3": stage3
+        })
 
-    save_conversation(conversation)
+        save_conversation(conversation)
 
 
 def update_conversation_title(conversation_id: str, title: str):
@@ -164,9 +239,10 @@ def update_conversation_title(conversation_id: str, title: str):
         conversation_id: Conversation identifier
         title: New title for the conversation
     """
-    conversation = get_conversation(conversation_id)
-    if conversation is None:
-        raise ValueError(f"Conversation {conversation_id} not found")
+    with _conversation_lock(conversation_id):
+        conversation = get_conversation(conversation_id)
+        if conversation is None:
+            raise ValueError(f"Conversation {conversation_id} not found")
 
-    conversation["title"] = title
-    save_conversation(conversation)
+        conversation["title"] = title
+        save_conversation(conversation)